@@ -5,13 +5,18 @@ import sys
 import ast
 import importlib.util
 import pkgutil
-import inspect
 import argparse
-import pyperclip
+import functools
 import re
-import tiktoken
+import io
+import tokenize
 import logging
-from typing import List
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Deque, Dict, FrozenSet, Iterator, List, Optional, Set, Tuple, Union
+
+if TYPE_CHECKING:
+    import tiktoken
 
 
 def read_file(path: str, remove_comments: bool = False) -> str:
@@ -25,59 +30,243 @@ def read_file(path: str, remove_comments: bool = False) -> str:
     Returns:
         str: ファイルの内容。
     """
+    # 更新日時をキャッシュのキーに含め、ファイルが更新された場合は読み込み直す
+    return _read_file_cached(path, os.path.getmtime(path), remove_comments)
+
+
+@functools.lru_cache(maxsize=None)
+def _read_file_cached(path: str, mtime: float, remove_comments: bool) -> str:
+    """
+    指定されたファイルを読み込み、その内容をキャッシュして返します。
+
+    Args:
+        path (str): 読み込むファイルのパス。
+        mtime (float): ファイルの更新日時。キャッシュのキーとしてのみ使用する。
+        remove_comments (bool): ドキュメントコメントを削除するかどうかを示すブール値。
 
-    with open(path, "r") as f:
-        content = f.read()
-        if remove_comments:
-            content = remove_docstring(content)
+    Returns:
+        str: ファイルの内容。
+    """
+    # 一度の読み込みでファイル全体を取得し、BOMやエンコーディング宣言に従ってデコードする(既定はUTF-8)
+    with open(path, "rb") as f:
+        data = f.read()
+    try:
+        encoding, _ = tokenize.detect_encoding(io.BytesIO(data).readline)
+    except SyntaxError:
+        # 不明なエンコーディング宣言の場合は、既定のUTF-8で読み込む
+        encoding = 'utf-8'
+    # 宣言と異なるエンコーディングのファイルでも探索と出力を続けられるよう、デコードできない文字は置換する
+    content = data.decode(encoding, errors='replace')
+    # テキストモードでの読み込みと同様に、改行コードを'\n'に統一する
+    if '\r' in content:
+        content = content.replace('\r\n', '\n').replace('\r', '\n')
+    if remove_comments:
+        # 依存関係の解析で作成した構文木を再利用する
+        try:
+            tree: Optional[ast.Module] = parse_file(path)
+        except SyntaxError:
+            tree = None
+        content = remove_docstring(content, tree)
     return content
 
 
-def remove_docstring(content):
+# '# 'から始まるコメントに一致する正規表現
+_HASH_COMMENT_RE = re.compile(r'# [^\n]*\n')
+# ドキュメントコメントと'# 'から始まるコメントのどちらかに一致する正規表現。一度の走査で両方を削除する
+_DOCSTRING_OR_COMMENT_RE = re.compile(r'(?:"""[\s\S]*?"""|\'\'\'[\s\S]*?\'\'\')\n|# [^\n]*\n')
+
+# ドキュメントコメントを持ち得るノードの型
+_DOCSTRING_OWNERS = (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)
+
+# Pythonファイルの探索時に降りないディレクトリの名前。これらのディレクトリ以下のファイルは依存関係の探索候補にならない
+_IGNORED_DIR_NAMES = frozenset({'.git', '.hg', '.svn', '__pycache__', '.venv', 'venv', '.tox', '.nox', 'node_modules'})
+
+# 文を子に持ち得るノードの型。ast.match_caseはPython 3.10以降にのみ存在する
+_STATEMENT_CONTAINERS = (ast.stmt, ast.excepthandler) + ((ast.match_case,) if hasattr(ast, 'match_case') else ())
+
+# ファイルのパスをキーに、(更新日時, 構文木)を保持するキャッシュ
+_ast_cache: Dict[str, Tuple[float, ast.Module]] = {}
+
+
+def parse_file(path: str) -> ast.Module:
+    """
+    指定されたPythonファイルを構文解析し、その構文木を返します。
+
+    一度解析したファイルは、更新日時が変わらない限りキャッシュした構文木を返します。
+
+    Args:
+        path (str): 構文解析するファイルのパス。
+
+    Returns:
+        ast.Module: ファイルの構文木。
+    """
+    return load_file(path)[1]
+
+
+def load_file(path: str) -> Tuple[str, ast.Module]:
+    """
+    指定されたPythonファイルを読み込んで構文解析し、その内容と構文木を返します。
+
+    内容と構文木はどちらもキャッシュされ、ファイルは一度だけ読み込み、一度だけ構文解析します。
+
+    Args:
+        path (str): 読み込むファイルのパス。
+
+    Returns:
+        Tuple[str, ast.Module]: ファイルの内容と構文木。
+    """
+    # 内容と構文木のキャッシュで同じ更新日時を使い、更新日時の再取得を省く
+    mtime = os.path.getmtime(path)
+    content = _read_file_cached(path, mtime, False)
+    cached = _ast_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return content, cached[1]
+
+    tree = ast.parse(content, filename=path)
+    _ast_cache[path] = (mtime, tree)
+    return content, tree
+
+
+def remove_docstring(content: str, tree: Optional[ast.Module] = None) -> str:
     """
     指定されたPythonコードからドキュメントコメントを削除します。
 
     Args:
         content (str): ドキュメントコメントを削除するPythonコード。
+        tree (Optional[ast.Module]): contentを解析済みの構文木。省略した場合はここで解析する。
 
     Returns:
         str: ドキュメントコメントが削除されたPythonコード。
     """
-    # ドキュメントコメントを削除する
-    omit_content = re.sub(r'""".*?"""\n', '', content, flags=re.DOTALL)
+    omit_content = content
+    # 文字列リテラルを含まないコードにはドキュメントコメントがないため、構文解析を省略する
+    if '"' in omit_content or "'" in omit_content:
+        if tree is None:
+            try:
+                tree = ast.parse(omit_content)
+            except SyntaxError:
+                tree = None
+
+        # 構文解析できないコードは、ドキュメントコメントとコメントを正規表現で一度に削除する
+        if tree is None:
+            return _DOCSTRING_OR_COMMENT_RE.sub('', omit_content)
+        # ドキュメントコメントを削除する
+        omit_content = strip_docstrings(omit_content, tree)
     # '# 'から始めるコメントを削除する
-    omit_content = re.sub(r'# .*?\n', '', omit_content)
+    if '# ' in omit_content:
+        omit_content = strip_comments(omit_content)
     return omit_content
 
 
-def is_package(module_name):
+def strip_comments(content: str) -> str:
     """
-    指定されたモジュールがパッケージであるかどうかを返します。
+    字句解析をもとに、'# 'から始まるコメントを削除します。
+
+    文字列リテラル内の'# 'は削除しません。コメントのみの行は行ごと削除します。
+    字句解析できないコードは正規表現で削除します。
 
     Args:
-        module_name (str): モジュール名。
+        content (str): コメントを削除するPythonコード。
 
     Returns:
-        bool: パッケージであるかどうかを示すブール値。
+        str: コメントが削除されたPythonコード。
     """
+    # 行番号をキーに、コメントの開始位置を保持する
+    comment_columns: Dict[int, int] = {}
     try:
-        spec = importlib.util.find_spec(module_name)
-    except (AttributeError, ModuleNotFoundError):
-        return False
-    return spec is not None and spec.submodule_search_locations is not None
+        for token in tokenize.generate_tokens(io.StringIO(content).readline):
+            if token.type == tokenize.COMMENT and token.string.startswith('# '):
+                comment_columns[token.start[0]] = token.start[1]
+    except (tokenize.TokenError, SyntaxError):
+        return _HASH_COMMENT_RE.sub('', content)
+
+    if not comment_columns:
+        return content
+
+    omit_lines: List[str] = []
+    # tokenizeの行番号は'\n'のみで数えるため、str.splitlinesではなく'\n'のみで分割する
+    for number, line in enumerate(io.StringIO(content).readlines(), 1):
+        column = comment_columns.get(number)
+        if column is None:
+            omit_lines.append(line)
+            continue
+        code = line[:column].rstrip()
+        if code:
+            newline = line[len(line.rstrip('\r\n')):]
+            omit_lines.append(code + newline)
+    return ''.join(omit_lines)
+
+
+def strip_docstrings(content: str, tree: ast.Module) -> str:
+    """
+    構文木をもとに、モジュール・クラス・関数の先頭にあるドキュメントコメントの行を削除します。
+
+    他のコードと同じ行にあるドキュメントコメントは削除しません。
+
+    Args:
+        content (str): ドキュメントコメントを削除するPythonコード。
+        tree (ast.Module): contentの構文木。
+
+    Returns:
+        str: ドキュメントコメントが削除されたPythonコード。
+    """
+    # 構文木の行番号は'\n'のみで数えるため、str.splitlinesではなく'\n'のみで分割する
+    lines: List[str] = io.StringIO(content).readlines()
+    removed_line_numbers: Set[int] = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, _DOCSTRING_OWNERS) or not node.body:
+            continue
+        first = node.body[0]
+        if not (isinstance(first, ast.Expr) and isinstance(first.value, ast.Constant) and isinstance(first.value.value, str)):
+            continue
+        # col_offsetはUTF-8のバイト単位のため、バイト列で前後の内容を確認する
+        head = lines[first.lineno - 1].encode()[:first.col_offset]
+        tail = lines[first.end_lineno - 1].encode()[first.end_col_offset:].strip()
+        if head.strip() or (tail and not tail.startswith(b'#')):
+            continue
+        removed_line_numbers.update(range(first.lineno, first.end_lineno + 1))
+
+    if not removed_line_numbers:
+        return content
+    return ''.join(line for number, line in enumerate(lines, 1) if number not in removed_line_numbers)
+
+
+def iter_import_nodes(tree: ast.AST) -> Iterator[Union[ast.Import, ast.ImportFrom]]:
+    """
+    構文木に含まれるImportノードとImportFromノードを返します。
 
+    import文は文の中にしか現れないため、式のノードには降りずに文のノードのみを幅優先で探索します。
+    返す順序はast.walkと同じです。
 
-def get_modules_in_package(package_name: str) -> List[str]:
+    Args:
+        tree (ast.AST): 探索する構文木。
+
+    Yields:
+        Union[ast.Import, ast.ImportFrom]: ImportノードまたはImportFromノード。
+    """
+    queue: Deque[ast.AST] = deque([tree])
+    while queue:
+        node = queue.popleft()
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            yield node
+            continue
+        # 文を含み得るノード(文、except節、case節)のみ探索対象にする
+        queue.extend(child for child in ast.iter_child_nodes(node) if isinstance(child, _STATEMENT_CONTAINERS))
+
+
+def get_modules_in_package(package_name: str, root_path: str = '') -> List[str]:
     """
     指定されたパッケージに含まれるモジュールの名前のリストを返します。
 
     Args:
         package_name (str): パッケージ名。
+        root_path (str): パッケージ名の起点となるディレクトリのパス。省略した場合はカレントディレクトリ。
 
     Returns:
         List[str]: パッケージに含まれるモジュールの名前のリスト。
     """
-    return [name for _, name, _ in pkgutil.iter_modules([package_name])]
+    # ドット区切りのパッケージ名をroot_path以下のディレクトリのパスに変換して探索する
+    return [name for _, name, _ in pkgutil.iter_modules([os.path.join(root_path, package_name.replace(".", os.sep))])]
 
 
 def get_module_if_contains(package_name: str, target_class_or_func_names: List[str]) -> List[str]:
@@ -91,21 +280,16 @@ def get_module_if_contains(package_name: str, target_class_or_func_names: List[s
     Returns:
         List[str]: 指定されたクラスまたは関数を含むモジュールの名前のリスト。
     """
+    target_names: Set[str] = set(target_class_or_func_names)
     modules = []
     for _, module_name, _ in pkgutil.iter_modules([package_name]):
         module = importlib.import_module(f"{package_name}.{module_name}")
-        for name, _ in inspect.getmembers(module):
-            for target_class_or_func_name in target_class_or_func_names:
-                if name == target_class_or_func_name:
-                    modules.append(module.__name__)
-                    break
+        # inspect.getmembersは全属性をgetattrするため、モジュールの名前空間の辞書と集合の共通部分で判定する
+        if vars(module).keys() & target_names:
+            modules.append(module.__name__)
     return modules
 
 
-def find_file(files, file):
-    return files.get(file)
-
-
 def get_all_py_paths(path) -> List[str]:
     """
     指定されたディレクトリ以下にある全てのPythonファイルのパスを取得します。
@@ -117,12 +301,20 @@ def get_all_py_paths(path) -> List[str]:
         List[str]: 相対パスのリスト。
     """
     all_py_paths: List[str] = []
-    for root, _dirs, files in os.walk(path):
-        for file in files:
-            if file.endswith('.py'):
-                absolute_path = os.path.join(root, file)
-                relative_path = os.path.relpath(absolute_path, path)
-                all_py_paths.append(relative_path)
+    # os.scandirのエントリが保持するファイル種別を使い、余分なstatを発生させずに走査する
+    # 相対パスはos.path.relpathで都度計算せず、ディレクトリの相対パスにファイル名を連結して作成する
+    stack: List[Tuple[str, str]] = [(path, '')]
+    while stack:
+        directory, relative_directory = stack.pop()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    # バージョン管理や仮想環境、キャッシュのディレクトリは探索しない
+                    if entry.name in _IGNORED_DIR_NAMES:
+                        continue
+                    stack.append((entry.path, f'{relative_directory}{entry.name}{os.sep}'))
+                elif entry.name.endswith('.py') and entry.is_file():
+                    all_py_paths.append(f'{relative_directory}{entry.name}')
     return all_py_paths
 
 
@@ -137,15 +329,12 @@ def exclude_paths(all_py_paths: List[str], excludes: List[str] = []) -> List[str
     Returns:
         List[str]: 除外後の全pythonファイルの辞書
     """
-    for exclude in excludes:
-        # 除外するファイルの相対パスが存在する場合、その要素を削除する
-        if exclude in all_py_paths:
-            all_py_paths.remove(exclude)
-
-    return all_py_paths
+    # './'や末尾の'/'などの表記ゆれを正規化した上で、集合で除外するファイルを判定する
+    exclude_set: Set[str] = {os.path.normpath(exclude) for exclude in excludes}
+    return [path for path in all_py_paths if path not in exclude_set]
 
 
-def code_split(code: str, max_chara: int = sys.maxsize, max_token: int = sys.maxsize) -> List[str]:
+def code_split(code: str, max_chara: int = sys.maxsize, max_token: int = sys.maxsize, code_tokens: Optional[int] = None) -> List[str]:
     """
     文字列がチャンクサイズより大きい場合、チャンクサイズに分割する。
 
@@ -155,30 +344,49 @@ def code_split(code: str, max_chara: int = sys.maxsize, max_token: int = sys.max
         string (str): 分割する文字列
         max_chara (int, optional): チャンクサイズ. Defaults to sys.maxsize.
         max_token (int, optional): チャンクサイズ. Defaults to sys.maxsize.
+        code_tokens (Optional[int], optional): 計算済みの文字列のトークン数. Defaults to None.
 
     Returns:
         List[str]: 分割後の文字列のリスト
     """
+    # トークン数の上限がない場合は、トークン数を計算しない
+    limit_tokens: bool = max_token < sys.maxsize
+    if code_tokens is None:
+        code_tokens = count_tokens(code) if limit_tokens else 0
 
     # チャンクサイズより文章が小さい場合、そのまま返す
-    if len(code) <= max_chara and count_tokens(code) <= max_token:
+    if len(code) <= max_chara and code_tokens <= max_token:
         return [code]
 
-    chunked_code: List[str] = ['']
+    # 各チャンクは文字列の連結を繰り返さないよう、部分文字列のリストとして保持し、最後に結合する
+    chunked_parts: List[List[str]] = [[]]
+    split_first_message = '\n```\n# The cord continued.'
     split_last_message = '\n```\n'
+    # 分割時に付与するメッセージのトークン数は、ループの外で一度だけ計算する
+    first_tokens: int = count_tokens(split_first_message) if limit_tokens else 0
+    last_tokens: int = count_tokens(split_last_message) if limit_tokens else 0
+
+    # 現在のチャンクの文字数とトークン数を保持し、チャンク全体を再計算しないようにする
+    current_chara: int = 0
+    current_tokens: int = 0
 
     # 文字列を改行で分割する
-    splited_rows: List[str] = code.split('\n')
+    rows: List[str] = [f'\n{splited_row}' for splited_row in code.split('\n')]
+    # 各行のトークン数は、ループの前にまとめて計算する
+    rows_tokens: List[int] = count_tokens_batch(rows) if limit_tokens else [0] * len(rows)
     # 改行で分割した文字列をチャンクサイズより小さくなるように結合する
-    for splited_row in splited_rows:
-        size_check_set = chunked_code[-1] + splited_row + split_last_message
-        if (len(size_check_set) > max_chara or count_tokens(size_check_set) > max_token):
-            chunked_code[-1] += split_last_message
-            chunked_code.append(f'\n```\n# The cord continued.\n{splited_row}')
+    for row, row_tokens in zip(rows, rows_tokens):
+        if current_chara + len(row) + len(split_last_message) > max_chara or current_tokens + row_tokens + last_tokens > max_token:
+            chunked_parts[-1].append(split_last_message)
+            chunked_parts.append([split_first_message, row])
+            current_chara = len(split_first_message) + len(row)
+            current_tokens = first_tokens + row_tokens
         else:
-            chunked_code[-1] += f'\n{splited_row}'
+            chunked_parts[-1].append(row)
+            current_chara += len(row)
+            current_tokens += row_tokens
 
-    return chunked_code
+    return [''.join(parts) for parts in chunked_parts]
 
 
 # 受け取ったテキストのトークン数を返す
@@ -193,52 +401,135 @@ def count_tokens(text: str, model: str = 'gpt-4') -> int:
     Returns:
         int: 受け取ったテキストのトークン数
     """
-    encoding = tiktoken.encoding_for_model(model)
-    return len(encoding.encode(text))
+    # count_tokens_batchと同じ数え方になるよう、特殊トークンも通常の文字列としてトークン化する
+    return len(_get_encoding(model).encode_ordinary(text))
+
+
+def count_tokens_batch(texts: List[str], model: str = 'gpt-4') -> List[int]:
+    """
+    受け取った複数のテキストのトークン数をまとめて計算して返す
+
+    tiktokenのバッチ処理を使い、複数のスレッドで並列にトークン化する。
+
+    Args:
+        texts (List[str]): 受け取ったテキストのリスト
+        model (str, optional): トークナイザーのモデル名. Defaults to 'gpt-4'.
+
+    Returns:
+        List[int]: 受け取ったテキストごとのトークン数のリスト
+    """
+    encoded_texts = _get_encoding(model).encode_ordinary_batch(texts, num_threads=os.cpu_count() or 1)
+    return [len(tokens) for tokens in encoded_texts]
+
+
+@functools.lru_cache(maxsize=None)
+def _get_encoding(model: str = 'gpt-4') -> 'tiktoken.Encoding':
+    """
+    モデル名に対応するトークナイザーを返す
+
+    一度生成したトークナイザーはキャッシュし、以降の呼び出しで再利用する。
+    tiktokenの読み込みは時間がかかるため、初めてトークン数を計算する時に読み込む。
+
+    Args:
+        model (str, optional): トークナイザーのモデル名. Defaults to 'gpt-4'.
+
+    Returns:
+        tiktoken.Encoding: トークナイザー
+    """
+    import tiktoken
+
+    return tiktoken.encoding_for_model(model)
+
+
+def resolve_relative_import(root_path: str, absolute_path: str, module_name: str, level: int) -> str:
+    """相対インポートのモジュール名を、ルートディレクトリからのモジュール名に変換する
+
+    Args:
+        root_path (str): ルートディレクトリのパス
+        absolute_path (str): インポートしているファイルの絶対パス
+        module_name (str): インポートするモジュール名。`from . import x`の場合は空文字
+        level (int): 相対インポートの階層(先頭の'.'の数)
+
+    Returns:
+        str: ルートディレクトリからのドット区切りのモジュール名
+    """
+    # os.path.dirnameを階層の数だけ繰り返さず、一度分割したパスからlevel階層分を取り除く
+    # 階層がパスの深さを超える場合は、os.path.dirnameと同様に先頭のディレクトリ(ルートの場合は'/')で止める
+    path_parts = absolute_path.split(os.sep)
+    base_dir = os.sep.join(path_parts[:max(len(path_parts) - level, 1)]) or os.sep
+
+    # root_pathとbase_dirの共通部分を削除するし、相対パスに変換する
+    package_relative_name = os.path.relpath(base_dir, root_path).replace(os.sep, ".")
+    # ルートディレクトリ直下のファイルからの相対インポートの場合は、モジュール名のみとする
+    if package_relative_name == ".":
+        return module_name
+    # モジュール名を結合する。`from . import x`の場合はパッケージ名のみとする
+    return f"{package_relative_name}.{module_name}" if module_name else package_relative_name
 
 
 class DependenciesSearcher():
     def __init__(self, root_path: str, module_paths: List[str], search_candidate_paths: List[str], depth: int = sys.maxsize):
         self.root_path: str = root_path
         self.module_paths: List[str] = module_paths
-        self.search_candidate_paths: List[str] = search_candidate_paths
+        # 探索候補のパスは所属の判定にのみ使うため、集合として保持する
+        self.search_candidate_paths: FrozenSet[str] = frozenset(search_candidate_paths)
         self.depth: int = depth
+        # ドット区切りのモジュール名をキーに、探索候補のファイルの相対パスを引けるようにする
+        self.module_index: Dict[str, str] = {path[:-3].replace(os.sep, "."): path for path in search_candidate_paths}
+        # 解析したファイルのパスをキーに、(ファイルの内容, 構文木)を保持する
+        self.parsed_files: Dict[str, Tuple[str, ast.Module]] = {}
+        # パッケージ名をキーに、パッケージに含まれるモジュールの名前を保持する。探索ごとにファイルシステムの状態を反映する
+        self.package_modules: Dict[str, List[str]] = {}
+        # 相対パスをキーに、存在を確認した絶対パスを保持する
+        self.absolute_paths: Dict[str, str] = {}
 
     # 起点となるファイルのパスから、依存関係を解析して、ファイルのパスを返す
     def search_dependencies(self) -> List[str]:
-        search_paths: List[List[str]] = [self.module_paths]
+        # 次に探索するファイルのパス。現在の階層と次の階層の2つだけを保持する
+        next_paths: List[str] = list(self.module_paths)
         searched_result_paths: List[str] = []
-        current_depth: int = 0  # 探索中の階層の深さを0で初期化
+        searched_path_set: Set[str] = set()  # 探索済みのパスの判定に使う集合
         logging.info('\n== Parsing module dependencies ==')
-        # 指定された深さまで依存関係を解析する
-        for i in range(0, self.depth + 1):
-            # 次に探索するファイルのパスを格納するリスト追加する
-            search_paths.append([])
-            # 現在の階層のログを出力する
-            logging.info(f"\nDepth: {current_depth}")
-            # 現在の階層のファイルのパスを取得する
-            for path in search_paths[current_depth]:
-                # 現在の階層のファイルのパスが探索済みのパスに含まれている場合、次のファイルのパスを探索する
-                if path in searched_result_paths or path not in self.search_candidate_paths:
-                    continue
-
-                logging.info(f"  {path}")
-                # 現在の階層のファイルのパスを探索済みのパスの先頭に追加する
-                searched_result_paths.insert(0, path)
-                # 現在の階層のファイルのパスから、依存関係を解析して、ファイルのパスを取得する。この時、絶対パスに変換する
-                dependencies: List[str] = self.extract_imports(path)
-                # 現在の階層のファイルのパスの依存関係のうち、探索済みのファイルのパスに含まれていない、かつ、探索候補のファイルのパスに含まれている場合は、次の階層のファイルのパスに追加する
-                for dependency in dependencies:
-                    if dependency in searched_result_paths or dependency not in self.search_candidate_paths:
+        # 起点のファイルが探索候補に含まれない場合(存在しない、除外した、探索しないディレクトリ以下にある)は警告する
+        for path in self.module_paths:
+            if path not in self.search_candidate_paths:
+                logging.warning(f'  Skipped {path}: not found among the search candidates')
+        # 同じ階層のファイルは互いに独立しているため、ファイルの読み込みと構文解析を並列に行う
+        with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as executor:
+            # 指定された深さまで依存関係を解析する
+            for current_depth in range(0, self.depth + 1):
+                # 現在の階層のログを出力する
+                logging.info(f"\nDepth: {current_depth}")
+                # 現在の階層のファイルのパスのうち、未探索かつ探索候補に含まれるものを取得する
+                current_paths: List[str] = []
+                for path in next_paths:
+                    if path in searched_path_set or path not in self.search_candidate_paths:
                         continue
 
-                    search_paths[current_depth + 1].append(dependency)
-            current_depth += 1  # 次の階層に移動する
-            # 次の階層のファイルのパスが存在しない場合、探索を終了する
-            if len(search_paths[current_depth]) == 0:
-                break
+                    logging.info(f"  {path}")
+                    # 現在の階層のファイルのパスを探索済みのパスの末尾に追加する(返却時に逆順にする)
+                    searched_result_paths.append(path)
+                    searched_path_set.add(path)
+                    current_paths.append(path)
+
+                # 次の階層のファイルのパスは、追加時に重複を除く
+                next_paths = []
+                next_path_set: Set[str] = set()
+                # 現在の階層のファイルのパスから、依存関係を解析して、ファイルのパスを取得する。結果は入力と同じ順序で返る
+                for dependencies in executor.map(self.extract_imports, current_paths):
+                    # 依存関係のうち、探索済みのファイルのパスに含まれていない、かつ、探索候補のファイルのパスに含まれている場合は、次の階層のファイルのパスに追加する
+                    for dependency in dependencies:
+                        if dependency in searched_path_set or dependency not in self.search_candidate_paths or dependency in next_path_set:
+                            continue
+
+                        next_paths.append(dependency)
+                        next_path_set.add(dependency)
+                # 次の階層のファイルのパスが存在しない場合、探索を終了する
+                if len(next_paths) == 0:
+                    break
 
-        return searched_result_paths
+        # 探索した順の逆順(依存先が先頭)で返す
+        return searched_result_paths[::-1]
 
     def extract_imports(self, relative_path: str) -> List[str]:
         """
@@ -251,76 +542,101 @@ class DependenciesSearcher():
         Returns:
             List[str]: インポートされたモジュールのファイルの相対パスのリスト。
         """
-        # ファイルの内容を読み込む
-        code = read_file(relative_path, remove_comments=False)
         absolute_path = self.absolute_path(relative_path)
-        # コードをASTで解析する
-        tree = ast.parse(code)
-
-        # AST内のすべてのImportFromノードを検索する
-        imports: List[ast.ImportFrom] = [node for node in ast.walk(tree) if isinstance(node, ast.ImportFrom)]
-
-        result_module_names = []
+        # ファイルの内容を読み込み、ASTで解析する。構文エラーのファイルは依存関係を解析せずに探索を続ける
+        try:
+            code, tree = load_file(relative_path)
+        except SyntaxError as e:
+            logging.warning(f'  Skipped parsing imports of {relative_path}: {e}')
+            return []
+        # 内容の出力時に再度読み込まないよう、読み込んだ内容と構文木を保持する
+        self.parsed_files[relative_path] = (code, tree)
+
+        result_module_names: List[str] = []
+
+        # AST内のすべてのImportノードとImportFromノードからモジュール名を取得する
+        for node in iter_import_nodes(tree):
+            # import文の場合は、インポートされた全てのモジュールを追加する
+            if isinstance(node, ast.Import):
+                result_module_names.extend(alias.name for alias in node.names)
+                continue
 
-        # モジュール名を取得する
-        for node in imports:
-            import_class_and_func_names = []
             module_name: str = node.module or ''
 
-            # インポートされたクラスや関数の名前を取得する
-            for alias in node.names:
-                import_class_and_func_names.append(alias.name)
-
             # 相対インポートの場合は、絶対インポートに変換する
             if node.level > 0:
-                base_dir = os.path.dirname(absolute_path)
-                for _ in range(node.level - 1):
-                    base_dir = os.path.dirname(base_dir)
-
-                # root_pathとbase_dirの共通部分を削除するし、相対パスに変換する
-                package_relative_name = os.path.relpath(base_dir, self.root_path).replace("/", ".")
-                # モジュール名を結合する
-                module_name = f"{package_relative_name}.{module_name}"
-
-            # モジュール名がパッケージであるの場合は、パッケージに含まれるモジュールの内、直接importしているクラスや関数を含むモジュールを取得する
-            if is_package(module_name):
-                modules = get_modules_in_package(module_name)
-                for module in modules:
-                    result_module_names.append(f"{package_relative_name}.{module}")
+                module_name = resolve_relative_import(self.root_path, absolute_path, module_name, node.level)
+
+            # `from pkg import module`のように、インポートした名前がモジュールである場合はそのモジュールを追加する
+            has_unresolved_name = False
+            for alias in node.names:
+                submodule_name = f"{module_name}.{alias.name}" if module_name else alias.name
+                if submodule_name in self.module_index:
+                    result_module_names.append(submodule_name)
+                else:
+                    has_unresolved_name = True
+            if not has_unresolved_name:
+                continue
+
+            # モジュールからのインポートの場合は、モジュール名を追加する
+            if module_name in self.module_index:
+                result_module_names.append(module_name)
                 continue
 
-            result_module_names.append(module_name)  # モジュール名を追加する
+            # パッケージからクラスや関数をインポートしている場合は、root_path以下のパッケージに含まれるモジュールを取得する
+            # find_specはroot_pathがsys.pathに含まれない場合に解決できないため、ファイルシステムで判定する
+            for module in self.modules_in_package(module_name):
+                result_module_names.append(f"{module_name}.{module}")
+
+        # モジュール名をファイルの相対パスに変換する。探索候補に含まれないモジュールは除外する
+        return [self.module_index[module_name] for module_name in result_module_names if module_name in self.module_index]
+
+    def modules_in_package(self, package_name: str) -> List[str]:
+        """パッケージに含まれるモジュールの名前のリストを返す
+
+        同じパッケージのディレクトリを繰り返し走査しないよう、結果をインスタンスに保持する。
+
+        Args:
+            package_name (str): パッケージ名
 
-        # モジュール名をファイルの相対パスに変換する
-        relative_paths = []
-        for module_name in result_module_names:
-            relative_path = module_name.replace(".", "/") + ".py"
-            relative_paths.append(relative_path)
-        return relative_paths
+        Returns:
+            List[str]: パッケージに含まれるモジュールの名前のリスト
+        """
+        modules = self.package_modules.get(package_name)
+        if modules is None:
+            modules = get_modules_in_package(package_name, self.root_path)
+            self.package_modules[package_name] = modules
+        return modules
 
     def absolute_path(self, relative_path: str) -> str:
         """相対パスを絶対パスに変換する
 
+        同じパスの存在確認を繰り返さないよう、結果をインスタンスに保持する。
+
         Args:
             relative_path (str): 相対パス
 
         Returns:
-            str: 絶対パス
+            str: 絶対パス。ファイルが存在しない場合は空文字
         """
-        absolute_path = os.path.join(self.root_path, relative_path)
-        # ファイルが存在しない場合は、空文字を返す
-        if not os.path.exists(absolute_path):
-            return ""
+        absolute_path = self.absolute_paths.get(relative_path)
+        if absolute_path is None:
+            absolute_path = os.path.join(self.root_path, relative_path)
+            # ファイルが存在しない場合は、空文字を返す
+            if not os.path.exists(absolute_path):
+                absolute_path = ""
+            self.absolute_paths[relative_path] = absolute_path
         return absolute_path
 
 
 class ContentCreator():
     def __init__(self, searched_result_paths: List[str] = [], max_chara: int = sys.maxsize, max_token: int = sys.maxsize,
-                 no_comment: bool = False):
+                 no_comment: bool = False, parsed_files: Dict[str, Tuple[str, ast.Module]] = {}):
         self.searched_result_paths = searched_result_paths
         self.max_chara = max_chara
         self.max_token = max_token
         self.no_comment = no_comment
+        self.parsed_files = parsed_files
 
     def create_content(self) -> List[str]:
         """指定されたファイルのパスのファイルの内容を取得する
@@ -329,29 +645,61 @@ class ContentCreator():
             List[str]: 指定されたファイルのパスのファイルの内容のリスト
         """
 
-        chunked_contents: List[str] = []
+        # 各チャンクは文字列の連結を繰り返さないよう、部分文字列のリストとして保持し、最後に結合する
+        chunked_parts: List[List[str]] = []
+        # 現在のチャンクの文字数とトークン数を保持し、チャンク全体を再計算しないようにする
+        current_chara: int = 0
+        current_tokens: int = 0
         logging.info('\n== Store file in Chunk ==')
-        for relative_path in self.searched_result_paths:
-            code = read_file(relative_path, self.no_comment)
-            content = f'\n### {relative_path}\n```\n{code}\n```\n'
-            if len(chunked_contents) == 0 or len(chunked_contents[-1] + content) > self.max_chara or count_tokens(chunked_contents[-1] + content) > self.max_token:
-                if len(content) > self.max_chara or count_tokens(content) > self.max_token:
+        contents: List[str] = [f'\n### {relative_path}\n```\n{self.read_code(relative_path)}\n```\n' for relative_path in self.searched_result_paths]
+        # 全ファイルのトークン数を、チャンクの作成前にまとめて計算する。トークン数の上限がない場合は計算しない
+        limit_tokens: bool = self.max_token < sys.maxsize
+        contents_tokens: List[int] = count_tokens_batch(contents) if limit_tokens else [0] * len(contents)
+        for relative_path, content, content_tokens in zip(self.searched_result_paths, contents, contents_tokens):
+            if len(chunked_parts) == 0 or current_chara + len(content) > self.max_chara or current_tokens + content_tokens > self.max_token:
+                if len(content) > self.max_chara or content_tokens > self.max_token:
                     # チャンクサイズを超えた場合、チャンクサイズに収まるように分割する
-                    chunked_codes: List[str] = code_split(content, self.max_chara, self.max_token)
+                    chunked_codes: List[str] = code_split(content, self.max_chara, self.max_token, content_tokens)
                     for chunked_code in chunked_codes:
-                        chunked_contents.append(chunked_code)
-                        logging.info(f'\nChunk {len(chunked_contents)}')
+                        chunked_parts.append([chunked_code])
+                        logging.info(f'\nChunk {len(chunked_parts)}')
                         logging.info(f'  {relative_path}(split)')
+                    current_chara = len(chunked_codes[-1])
+                    current_tokens = count_tokens(chunked_codes[-1]) if limit_tokens else 0
                 else:
                     # チャンクサイズを超えた場合、新しいチャンクを作成する
-                    chunked_contents.append(content)
-                    logging.info(f'\nChunk {len(chunked_contents)}')
+                    chunked_parts.append([content])
+                    logging.info(f'\nChunk {len(chunked_parts)}')
                     logging.info(f'  {relative_path}')
+                    current_chara = len(content)
+                    current_tokens = content_tokens
             else:
                 # チャンクサイズを超えない場合、現在のチャンクに追加する
-                chunked_contents[-1] += content
+                chunked_parts[-1].append(content)
                 logging.info(f'  {relative_path}')
-        return chunked_contents
+                current_chara += len(content)
+                current_tokens += content_tokens
+        return [''.join(parts) for parts in chunked_parts]
+
+    def read_code(self, relative_path: str) -> str:
+        """指定されたファイルの内容を取得する
+
+        依存関係の解析時に読み込んだファイルは、その内容と構文木を再利用する。
+
+        Args:
+            relative_path (str): ファイルの相対パス
+
+        Returns:
+            str: ファイルの内容
+        """
+        parsed = self.parsed_files.get(relative_path)
+        if parsed is None:
+            return read_file(relative_path, self.no_comment)
+
+        code, tree = parsed
+        if self.no_comment:
+            code = remove_docstring(code, tree)
+        return code
 
 
 def main(root_path: str, module_paths: List[str] = [], depth: int = sys.maxsize, no_comment: bool = False, max_chara: int = sys.maxsize,
@@ -404,14 +752,15 @@ def main(root_path: str, module_paths: List[str] = [], depth: int = sys.maxsize,
     searched_result_paths: List[str] = searcher.search_dependencies()
 
     # 依存関係を解析したファイルのパスから、ファイルの内容を取得する
-    creator = ContentCreator(searched_result_paths, max_chara, max_token, no_comment)
+    creator = ContentCreator(searched_result_paths, max_chara, max_token, no_comment, searcher.parsed_files)
     chunked_content: List[str] = creator.create_content()
 
     return chunked_content
 
 
 # 取得したコードと文字数やトークン数、chunkの数を表示する
-def print_result(chunked_content: List[str], max_chara: int = sys.maxsize, max_token: int = sys.maxsize) -> None:
+def print_result(chunked_content: List[str], max_chara: int = sys.maxsize, max_token: int = sys.maxsize,
+                 chunk_tokens: Optional[List[int]] = None) -> None:
     """
     取得したコードと文字数やトークン数、chunkの数を表示する
 
@@ -419,16 +768,22 @@ def print_result(chunked_content: List[str], max_chara: int = sys.maxsize, max_t
         chunked_content (List[str]): 取得したコードのリスト
         max_chara (int, optional): ファイルの内容を取得する際のチャンクサイズ. Defaults to sys.maxsize.
         max_token (int, optional): ファイルの内容を取得する際のチャンクサイズ. Defaults to sys.maxsize.
+        chunk_tokens (Optional[List[int]], optional): 計算済みのchunkごとのトークン数. Defaults to None.
 
     Returns:
         None
     """
-    joined_content: str = ''.join(chunked_content)
-    lines = joined_content.split('\n')
+    if chunk_tokens is None:
+        chunk_tokens = count_tokens_batch(chunked_content)
+
+    # 全てのチャンクを結合した文字列は作成せず、チャンクごとの集計値を合計する
+    total_characters: int = sum(len(content) for content in chunked_content)
+    total_lines: int = sum(content.count('\n') for content in chunked_content) + 1
+    total_tokens: int = sum(chunk_tokens)
     print('\n== Result ==\n')
-    print(f'total characters: {len(joined_content)}')
-    print(f'total lines:      {len(lines)}')
-    print(f'total tokens:     {count_tokens(joined_content)} (encoded for gpt-4)')
+    print(f'total characters: {total_characters}')
+    print(f'total lines:      {total_lines}')
+    print(f'total tokens:     {total_tokens} (encoded for gpt-4)')
     if len(chunked_content) > 1:
         print(f'total chunks:     {len(chunked_content)}')
         if max_chara < sys.maxsize:
@@ -438,25 +793,33 @@ def print_result(chunked_content: List[str], max_chara: int = sys.maxsize, max_t
 
 
 # chunked_content を順番にクリップボードにコピーする
-def copy_to_clipboard(chunked_content: List[str]):
+def copy_to_clipboard(chunked_content: List[str], chunk_tokens: Optional[List[int]] = None):
     """
     chunked_content を順番にクリップボードにコピーする
 
     Args:
         chunked_content (List[str]): コピーする内容のリスト
+        chunk_tokens (Optional[List[int]], optional): 計算済みのchunkごとのトークン数. Defaults to None.
 
     Returns:
         None
     """
+    # pyperclipの読み込みは時間がかかるため、クリップボードへコピーする時に初めて読み込む
+    import pyperclip
+
     print('\n== Copy to clipboard ==')
-    for content in chunked_content:
+    chunk_count = len(chunked_content)
+    # 各chunkのトークン数は、コピーの前にまとめて計算する
+    if chunk_tokens is None:
+        chunk_tokens = count_tokens_batch(chunked_content)
+    for chunk_number, (content, content_tokens) in enumerate(zip(chunked_content, chunk_tokens), 1):
         pyperclip.copy(content)
         # chunkのナンバーを表示する
-        print(f'\nChunk {chunked_content.index(content) + 1} of {len(chunked_content)} copied to clipboard.')
+        print(f'\nChunk {chunk_number} of {chunk_count} copied to clipboard.')
         # 文字数とトークン数を表示する
-        print(f'  ({len(content)} chara, {count_tokens(content)} tokens)')
+        print(f'  ({len(content)} chara, {content_tokens} tokens)')
         # chunkが最後のchunkでない場合、Enterキーを押すまで待機する
-        if chunked_content.index(content) + 1 < len(chunked_content):
+        if chunk_number < chunk_count:
             input('\nPress Enter to continue...')
 
 
@@ -487,8 +850,11 @@ if __name__ == "__main__":
     chunked_content = main(root_dir, module_paths=args.module_path, depth=args.depth, no_comment=args.no_comment, max_chara=args.max_chara,
                            max_token=args.max_token, excludes=args.exclude)
 
+    # chunkごとのトークン数は一度だけ計算し、表示とコピーで共有する
+    chunk_tokens = count_tokens_batch(chunked_content)
+
     # 取得したコードと文字数やトークン数、chunkの数を表示する
-    print_result(chunked_content, max_chara=args.max_chara, max_token=args.max_token)
+    print_result(chunked_content, max_chara=args.max_chara, max_token=args.max_token, chunk_tokens=chunk_tokens)
 
     # chunked_content を順番にクリップボードにコピーする
-    copy_to_clipboard(chunked_content)
+    copy_to_clipboard(chunked_content, chunk_tokens=chunk_tokens)
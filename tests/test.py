@@ -1,6 +1,210 @@
 # pytestを使用してテストを実行する
+import ast
+import logging
+import os
+
 import pytest
 
+from import_collector.main import (
+    ContentCreator, DependenciesSearcher, code_split, exclude_paths, get_all_py_paths, iter_import_nodes, read_file, remove_docstring,
+    resolve_relative_import, strip_comments, strip_docstrings)
+
+MOCK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mock')
+
+
+def _write(path, content):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+
+
+# strip_docstrings()のテスト
+def test_strip_docstrings_removes_docstring_lines():
+    code = '"""Module."""\nimport os\n\n\nclass A:\n    """\n    Class.\n    """\n    def f(self):\n        """Func."""\n        return 1\n'
+    assert strip_docstrings(code, ast.parse(code)) == 'import os\n\n\nclass A:\n    def f(self):\n        return 1\n'
+
+
+def test_strip_docstrings_keeps_other_string_literals():
+    code = 'X = """not a docstring"""\n\n\ndef f(): """same line"""; return 1\n'
+    assert strip_docstrings(code, ast.parse(code)) == code
+
+
+@pytest.mark.parametrize('separator', ['\x0c', '\x1c', '\x85', '\u2028'])
+def test_strip_docstrings_counts_lines_by_newline_only(separator):
+    code = f's = "a{separator}b"\ndef f():\n    """doc"""\n    return 2\n'
+    assert strip_docstrings(code, ast.parse(code)) == f's = "a{separator}b"\ndef f():\n    return 2\n'
+
+
+def test_remove_docstring_with_form_feed_line():
+    code = 'x = 1\n\x0c\ndef f():\n    """doc"""\n    return 2\n'
+    assert remove_docstring(code) == 'x = 1\n\x0c\ndef f():\n    return 2\n'
+
+
+# strip_comments()のテスト
+def test_strip_comments_removes_comment_lines_and_trailing_comments():
+    code = '#!/usr/bin/env python\n# top\nimport os  # trailing\nX = "# not a comment"\n'
+    assert strip_comments(code) == '#!/usr/bin/env python\nimport os\nX = "# not a comment"\n'
+
+
+@pytest.mark.parametrize('separator', ['\x0c', '\x1c', '\x85', '\u2028'])
+def test_strip_comments_counts_lines_by_newline_only(separator):
+    code = f'x = "a{separator}b"\ndef g():\n    # only comment\n    return 3\n'
+    assert strip_comments(code) == f'x = "a{separator}b"\ndef g():\n    return 3\n'
+
+
+def test_strip_comments_with_form_feed_line():
+    code = 'x = 1\n\x0c\ndef g():\n    # only comment\n    return 3\n'
+    assert strip_comments(code) == 'x = 1\n\x0c\ndef g():\n    return 3\n'
+
+
+# iter_import_nodes()のテスト
+def test_iter_import_nodes_matches_ast_walk():
+    code = (
+        'import os\n'
+        'try:\n    import json\nexcept ImportError:\n    from . import fallback\n'
+        'class A:\n    def f(self):\n        with open(x) as f:\n            from .b import c\n'
+        'y = [i for i in range(3)]\n'
+    )
+    tree = ast.parse(code)
+    expected = [node for node in ast.walk(tree) if isinstance(node, (ast.Import, ast.ImportFrom))]
+    assert list(iter_import_nodes(tree)) == expected
+    assert len(expected) == 4
+
+
+# read_file()のテスト
+def test_read_file_falls_back_to_utf8_for_unknown_coding(tmp_path):
+    path = tmp_path / 'bad.py'
+    path.write_bytes('# -*- coding: bogus -*-\nx = "é"\n'.encode('utf-8'))
+    assert read_file(str(path)) == '# -*- coding: bogus -*-\nx = "é"\n'
+    assert read_file(str(path), remove_comments=True) == 'x = "é"\n'
+
+
+def test_read_file_honors_coding_declaration(tmp_path):
+    path = tmp_path / 'latin.py'
+    path.write_bytes('# -*- coding: latin-1 -*-\nx = "é"\n'.encode('latin-1'))
+    assert read_file(str(path)) == '# -*- coding: latin-1 -*-\nx = "é"\n'
 
 
 # get_all_py_paths()のテスト
+def test_get_all_py_paths_skips_ignored_directories(tmp_path):
+    _write(tmp_path / 'a.py', '')
+    _write(tmp_path / 'pkg' / 'b.py', '')
+    _write(tmp_path / 'pkg' / 'c.txt', '')
+    for ignored in ('.git', '__pycache__', 'venv', 'node_modules'):
+        _write(tmp_path / ignored / 'x.py', '')
+        _write(tmp_path / 'pkg' / ignored / 'y.py', '')
+    assert sorted(get_all_py_paths(str(tmp_path))) == ['a.py', os.path.join('pkg', 'b.py')]
+
+
+# exclude_paths()のテスト
+def test_exclude_paths_normalizes_excludes():
+    all_py_paths = ['a.py', 'b.py', os.path.join('pkg', 'c.py')]
+    assert exclude_paths(all_py_paths, ['./a.py']) == ['b.py', os.path.join('pkg', 'c.py')]
+    assert exclude_paths(all_py_paths, ['a.py', os.path.join('.', 'pkg', '', 'c.py')]) == ['b.py']
+    assert exclude_paths(all_py_paths) == all_py_paths
+
+
+# resolve_relative_import()のテスト
+def test_resolve_relative_import():
+    root = os.path.join(os.sep, 'root')
+    assert resolve_relative_import(root, os.path.join(root, 'pkg', 'a.py'), 'b', 1) == 'pkg.b'
+    assert resolve_relative_import(root, os.path.join(root, 'pkg', 'sub', 'a.py'), 'b', 2) == 'pkg.b'
+    assert resolve_relative_import(root, os.path.join(root, 'pkg', 'a.py'), '', 1) == 'pkg'
+    assert resolve_relative_import(root, os.path.join(root, 'a.py'), 'b', 1) == 'b'
+    # 階層がパスの深さを超える場合も例外にしない
+    assert isinstance(resolve_relative_import(root, os.path.join(root, 'pkg', 'a.py'), 'x', 5), str)
+    assert isinstance(resolve_relative_import('.', os.path.join('.', 'a.py'), 'x', 3), str)
+
+
+# DependenciesSearcherのテスト
+def test_search_dependencies_without_root_on_sys_path(tmp_path, monkeypatch):
+    _write(tmp_path / 'pkg' / '__init__.py', '')
+    _write(tmp_path / 'pkg' / 'a.py', 'from . import b\nimport pkg.c, pkg.d\nfrom .sub import helper\n')
+    _write(tmp_path / 'pkg' / 'b.py', '')
+    _write(tmp_path / 'pkg' / 'c.py', '')
+    _write(tmp_path / 'pkg' / 'd.py', '')
+    _write(tmp_path / 'pkg' / 'sub' / '__init__.py', 'from .e import helper\n')
+    _write(tmp_path / 'pkg' / 'sub' / 'e.py', 'def helper():\n    pass\n')
+    _write(tmp_path / 'pkg' / 'unused.py', '')
+    monkeypatch.chdir(tmp_path)
+    searcher = DependenciesSearcher('.', [os.path.join('pkg', 'a.py')], get_all_py_paths('.'))
+    result = {os.path.normpath(path) for path in searcher.search_dependencies()}
+    expected = {os.path.join('pkg', name) for name in ('a.py', 'b.py', 'c.py', 'd.py')}
+    expected.add(os.path.join('pkg', 'sub', 'e.py'))
+    assert result == expected
+
+
+def test_search_dependencies_reflects_new_package_modules(tmp_path, monkeypatch):
+    _write(tmp_path / 'pkg' / '__init__.py', '')
+    _write(tmp_path / 'pkg' / 'a.py', 'def f():\n    pass\n')
+    _write(tmp_path / 'main.py', 'from pkg import f\n')
+    monkeypatch.chdir(tmp_path)
+    first = DependenciesSearcher('.', ['main.py'], get_all_py_paths('.')).search_dependencies()
+    assert os.path.join('pkg', 'b.py') not in first
+    _write(tmp_path / 'pkg' / 'b.py', '')
+    second = DependenciesSearcher('.', ['main.py'], get_all_py_paths('.')).search_dependencies()
+    assert os.path.join('pkg', 'b.py') in second
+
+
+def test_absolute_path_reflects_created_file(tmp_path):
+    assert DependenciesSearcher(str(tmp_path), [], []).absolute_path('a.py') == ''
+    _write(tmp_path / 'a.py', '')
+    assert DependenciesSearcher(str(tmp_path), [], []).absolute_path('a.py') == os.path.join(str(tmp_path), 'a.py')
+
+
+def test_search_dependencies_skips_unparsable_files(tmp_path, monkeypatch, caplog):
+    _write(tmp_path / 'main.py', 'import broken\nimport latin\n')
+    _write(tmp_path / 'broken.py', 'def f(:\n')
+    (tmp_path / 'latin.py').write_bytes(b'x = "\xff\xfe"\n')
+    monkeypatch.chdir(tmp_path)
+    searcher = DependenciesSearcher('.', ['main.py'], get_all_py_paths('.'))
+    with caplog.at_level(logging.WARNING):
+        result = searcher.search_dependencies()
+    assert sorted(result) == ['broken.py', 'latin.py', 'main.py']
+    assert 'Skipped parsing imports of broken.py' in caplog.text
+    assert '\ufffd' in ContentCreator(result).create_content()[0]
+
+
+def test_search_dependencies_warns_about_unknown_module_paths(tmp_path, monkeypatch, caplog):
+    _write(tmp_path / 'venv' / 'mod.py', '')
+    monkeypatch.chdir(tmp_path)
+    searcher = DependenciesSearcher('.', [os.path.join('venv', 'mod.py')], get_all_py_paths('.'))
+    with caplog.at_level(logging.WARNING):
+        assert searcher.search_dependencies() == []
+    assert f"Skipped {os.path.join('venv', 'mod.py')}" in caplog.text
+
+
+def test_search_dependencies_with_mock_apps(monkeypatch):
+    monkeypatch.chdir(MOCK_DIR)
+    module_paths = [os.path.join(app, 'dir_1', 'dir_1_1', 'dir_1_1_1', 'module_1_1_1.py') for app in ('app_1', 'app_2')]
+    searcher = DependenciesSearcher('.', module_paths, get_all_py_paths('.'))
+    result = [os.path.normpath(path) for path in searcher.search_dependencies()]
+    assert sorted(result) == sorted(module_paths + [os.path.join(app, 'dir_1', 'dir_1_2', 'module_1_2.py') for app in ('app_1', 'app_2')])
+
+
+# code_split()のテスト
+def test_code_split_returns_small_code_as_is():
+    code = 'x = 1\ny = 2\n'
+    assert code_split(code, max_chara=len(code)) == [code]
+
+
+def test_code_split_keeps_chunks_within_max_chara():
+    rows = [f'value_{i} = {i}' for i in range(50)]
+    code = '\n'.join(rows)
+    max_chara = 100
+    chunks = code_split(code, max_chara=max_chara)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= max_chara for chunk in chunks)
+    joined = ''.join(chunks)
+    assert all(f'\n{row}' in joined for row in rows)
+
+
+# ContentCreatorのテスト
+def test_create_content_keeps_chunks_within_max_chara(monkeypatch):
+    monkeypatch.chdir(MOCK_DIR)
+    paths = sorted(path for path in get_all_py_paths('.') if path.startswith('app_1'))
+    max_chara = 200
+    chunks = ContentCreator(paths, max_chara=max_chara).create_content()
+    assert all(len(chunk) <= max_chara for chunk in chunks)
+    joined = ''.join(chunks)
+    assert all(f'### {path}' in joined for path in paths)
+    assert ''.join(ContentCreator(paths).create_content()) == ''.join(f'\n### {path}\n```\n{read_file(path)}\n```\n' for path in paths)